@@ -0,0 +1,628 @@
+"""Core protocol-chain execution for aleph.
+
+An :class:`AgentChain` runs a sequence of :class:`Protocol` steps
+(Extract -> Atomize -> Reflect -> Integrate) against a directory of
+markdown "reservoirs", accumulating each protocol's output in a
+working-memory file (``instance.md``).
+"""
+
+import asyncio
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+from atomic_agents.agents.base_agent import (
+    BaseAgent,
+    BaseAgentConfig,
+    BaseAgentInputSchema,
+)
+
+from aleph.utils import (
+    load_markdown,
+    load_markdown_batch,
+    read_text_file,
+    write_text_atomic,
+)
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_HEADER = "# Working Memory\n"
+# Marks the operator-editable block of the instance file; the editor
+# helpers in aleph.ui locate and rewrite the block by this exact string.
+USER_INPUT_MARKER = "[User Input]:"
+DEFAULT_MAX_TOKENS = 8096
+
+
+class Protocol:
+    """A single named step in a chain, with its prompt and reservoir accesses.
+
+    ``accesses`` maps a human-readable label to a markdown filename inside
+    the reservoir directory; the special filename ``instance.md`` refers to
+    the chain's own working memory.  ``depends_on`` names the protocols
+    whose outputs this one consumes; protocols with no unfinished
+    dependencies may run concurrently.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        prompt_file: str | Path,
+        accesses: dict[str, str] | None = None,
+        include_in_chain: bool = True,
+        depends_on: list[str] | None = None,
+    ) -> None:
+        self.name = name
+        self.prompt = load_markdown(str(prompt_file))
+        self.accesses = dict(accesses or {})
+        self.include_in_chain = include_in_chain
+        self.depends_on = list(depends_on or [])
+        # The header depends only on the protocol, not on per-call inputs,
+        # so format it once here rather than on every run.
+        self._prompt_header = f"Protocol: {name}\nInstructions:\n{self.prompt}\n\n"
+        # accesses is fixed after construction, so classify each entry once
+        # instead of normalizing the filename on every protocol run.
+        self._self_refs = {
+            label
+            for label, filename in self.accesses.items()
+            if filename.strip().lower() == "instance.md"
+        }
+        self._external_accesses = {
+            label: filename
+            for label, filename in self.accesses.items()
+            if label not in self._self_refs
+        }
+
+
+class AgentChain(BaseAgent):
+    """An agent that executes protocol chains over a working-memory file.
+
+    The working memory (``instance.md``) is strictly append-only during a
+    chain: each protocol's output is appended as a new section.  To avoid
+    re-reading and rewriting the whole file on every step, the chain keeps
+    an append-mode file handle plus an in-memory ``StringIO`` mirror, so
+    reads are served from memory and disk only ever sees appends.
+    """
+
+    def __init__(
+        self,
+        config: BaseAgentConfig,
+        instance_file: str | Path = "instance.md",
+        async_client=None,
+    ) -> None:
+        """``async_client`` is an async instructor client (e.g.
+        ``instructor.from_anthropic(anthropic.AsyncAnthropic(...))``); it is
+        only needed for the ``run_*_async`` streaming paths, which cannot be
+        driven by the sync client in ``config``.
+        """
+        super().__init__(config)
+        self.async_client = async_client
+        # The Anthropic Messages API requires max_tokens on every call, so
+        # resolve the configured limit once for the direct-create paths.
+        self._max_tokens = getattr(config, "max_tokens", None) or DEFAULT_MAX_TOKENS
+        self.instance_file = Path(instance_file)
+        existing = ""
+        if self.instance_file.exists():
+            # Cold start after a restart is the only time the instance file
+            # is read from disk; large working memories go through mmap.
+            size = self.instance_file.stat().st_size
+            if size:
+                existing = read_text_file(str(self.instance_file), size)
+        # Raw append-mode fd: instance.md is authored with \n only, so the
+        # text layer's newline translation and per-write open/close would be
+        # pure overhead.
+        self._instance_fd = os.open(
+            str(self.instance_file), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+        self._instance_buf = io.StringIO()
+        self._instance_buf.write(existing)
+        self._instance_lock = threading.Lock()
+        self._instance_async_lock = asyncio.Lock()
+
+    def _append_to_instance(self, section: str) -> None:
+        """Append a section to the working memory (disk and in-memory mirror)."""
+        with self._instance_lock:
+            os.write(self._instance_fd, section.encode("utf-8"))
+            self._instance_buf.write(section)
+
+    def _read_instance(self) -> str:
+        """Return the current working-memory contents from the in-memory mirror."""
+        return self._instance_buf.getvalue()
+
+    def _ensure_instance_fd(self) -> None:
+        """Reopen the append fd if the instance file was replaced on disk.
+
+        Atomic rewrites (the editor save in :mod:`aleph.ui`) swap in a new
+        inode; without this check every subsequent append would land on the
+        old, unlinked file and be lost on process exit.
+        """
+        try:
+            disk_ino = os.stat(self.instance_file).st_ino
+        except FileNotFoundError:
+            disk_ino = None
+        if disk_ino != os.fstat(self._instance_fd).st_ino:
+            os.close(self._instance_fd)
+            self._instance_fd = os.open(
+                str(self.instance_file), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+            )
+
+    def _reset_instance(self, content: str) -> None:
+        """Truncate the working memory and start over with ``content``."""
+        self._ensure_instance_fd()
+        os.ftruncate(self._instance_fd, 0)
+        os.lseek(self._instance_fd, 0, os.SEEK_SET)
+        self._instance_buf = io.StringIO()
+        self._append_to_instance(content)
+
+    def _flush_instance(self) -> None:
+        """Make completed-chain appends durable (called at chain boundaries)."""
+        os.fsync(self._instance_fd)
+
+    @staticmethod
+    def _system_blocks(static: str, volatile: str) -> list[dict]:
+        """System content blocks with the static half ahead of the cache boundary."""
+        return [
+            {
+                "type": "text",
+                "text": static,
+                "cache_control": {"type": "ephemeral"},
+            },
+            {"type": "text", "text": volatile},
+        ]
+
+    def get_response(self, response_model=None, system_blocks=None, memory=None):
+        """Like BaseAgent.get_response, but with per-call prompt and memory.
+
+        Threading the system blocks and an isolated memory through as
+        arguments (instead of mutating shared agent state) lets concurrent
+        protocols run without clobbering each other's prompts or history.
+        """
+        if system_blocks is None:
+            return super().get_response(response_model=response_model)
+        if response_model is None:
+            response_model = self.output_schema
+        messages = [{"role": "system", "content": system_blocks}]
+        messages += (memory or self.memory).get_history()
+        return self.client.chat.completions.create(
+            model=self.model,
+            max_tokens=self._max_tokens,
+            messages=messages,
+            response_model=response_model,
+        )
+
+    @staticmethod
+    def _prewarm_reservoirs(protocols: list[Protocol], reservoir_dir: Path) -> None:
+        """Load every reservoir the chain will access once, priming the cache."""
+        for protocol in protocols:
+            for filename in protocol._external_accesses.values():
+                path = reservoir_dir / filename
+                if path.is_file():
+                    load_markdown(str(path))
+
+    def _load_access_contents(
+        self,
+        protocol: Protocol,
+        reservoir_dir: Path,
+        reservoir_cache: dict[str, str] | None = None,
+    ) -> dict[int, str]:
+        """Batch-load a protocol's external accesses, keyed by access position.
+
+        ``reservoir_cache`` maps path -> content for the enclosing chain
+        run; entries already present are reused without touching disk, so a
+        reservoir named under several labels (or by several protocols in a
+        chain) is read and decoded once.  Concurrent protocols may race on
+        the dict, which at worst repeats a read.
+        """
+        items = list(protocol.accesses.items())
+        disk_indices = [
+            i for i, (label, _) in enumerate(items) if label not in protocol._self_refs
+        ]
+        loaded_contents: dict[int, str] = {}
+        if disk_indices:
+            if reservoir_cache is None:
+                reservoir_cache = {}
+            paths = {i: str(reservoir_dir / items[i][1]) for i in disk_indices}
+            to_read = sorted({p for p in paths.values() if p not in reservoir_cache})
+            if to_read:
+                for path, content in zip(to_read, load_markdown_batch(to_read)):
+                    if content is not None:
+                        reservoir_cache[path] = content
+            for i, path in paths.items():
+                content = reservoir_cache.get(path)
+                if content is None:
+                    logger.warning(
+                        "Could not load reservoir '%s' from file '%s'",
+                        items[i][0],
+                        items[i][1],
+                    )
+                else:
+                    loaded_contents[i] = content
+        return loaded_contents
+
+    @staticmethod
+    def _build_prompt_parts(
+        protocol: Protocol,
+        user_input: str,
+        instance_content: str,
+        loaded_contents: dict[int, str],
+        commentary: str | None,
+    ) -> tuple[str, str]:
+        """Assemble the prompt as (static, volatile) halves in one StringIO pass.
+
+        The static half (protocol header plus reservoir sections) is
+        byte-identical across runs of a protocol while the reservoirs are
+        unchanged, so it can sit in front of Anthropic's prompt-cache
+        boundary; everything that varies per call (working memory,
+        commentary, user input) goes in the volatile half.  The heavy
+        strings are copied exactly once, with no per-section intermediates.
+        """
+        buf = io.StringIO()
+        buf.write(protocol._prompt_header)
+        buf.write("Access Contexts:\n")
+        sep = ""
+        # Each distinct source appears once: a file reachable under several
+        # labels is embedded only under the first, and self-references are
+        # covered by the single Working Memory section below — duplicated
+        # reservoir text would be pure token cost on every LLM call.
+        seen_files: set[str] = set()
+        for i, (label, filename) in enumerate(protocol.accesses.items()):
+            if label in protocol._self_refs or i not in loaded_contents:
+                continue
+            if filename in seen_files:
+                continue
+            seen_files.add(filename)
+            buf.write(sep)
+            buf.write("### ")
+            buf.write(label)
+            buf.write(":\n")
+            buf.write(loaded_contents[i])
+            sep = "\n\n"
+        static = buf.getvalue()
+
+        buf = io.StringIO()
+        if commentary:
+            buf.write("\n\nOperator Commentary:\n")
+            buf.write(commentary)
+        buf.write("\n\nWorking Memory:\n")
+        buf.write(instance_content)
+        buf.write("\n\nUser Input:\n")
+        buf.write(user_input)
+        return static, buf.getvalue()
+
+    def run_protocol(
+        self,
+        user_input: str,
+        protocol: Protocol,
+        reservoir_dir: Path,
+        commentary: str | None = None,
+        reservoir_cache: dict[str, str] | None = None,
+    ) -> str:
+        """Execute a single protocol and append its output to the working memory."""
+        instance_content = self._read_instance()
+        loaded_contents = self._load_access_contents(
+            protocol, reservoir_dir, reservoir_cache
+        )
+        static, volatile = self._build_prompt_parts(
+            protocol, user_input, instance_content, loaded_contents, commentary
+        )
+
+        agent_input = BaseAgentInputSchema(chat_message=user_input)
+        memory = self.memory.copy()
+        memory.add_message("user", agent_input)
+        response = self.get_response(
+            system_blocks=self._system_blocks(static, volatile), memory=memory
+        )
+        result_text = response.chat_message.strip()
+
+        self._append_to_instance(f"\n---\n\n## {protocol.name}\n\n{result_text}\n")
+        return result_text
+
+    async def run_protocol_async(
+        self,
+        user_input: str,
+        protocol: Protocol,
+        reservoir_dir: Path,
+        commentary: str | None = None,
+        reservoir_cache: dict[str, str] | None = None,
+        on_chunk: Callable[[str], None] | None = None,
+    ) -> str:
+        """Async variant of :meth:`run_protocol`, streaming the response.
+
+        ``on_chunk`` is invoked with each newly streamed text delta as it
+        arrives (concatenating the deltas reproduces the full response), so
+        callers can render or post-process output concurrently with the
+        decode instead of waiting for the full response.
+        """
+        if self.async_client is None:
+            raise RuntimeError(
+                "run_protocol_async requires an async instructor client; "
+                "construct the AgentChain with async_client="
+                "instructor.from_anthropic(anthropic.AsyncAnthropic(...))"
+            )
+        instance_content = self._read_instance()
+        loaded_contents = await asyncio.to_thread(
+            self._load_access_contents, protocol, reservoir_dir, reservoir_cache
+        )
+        static, volatile = self._build_prompt_parts(
+            protocol, user_input, instance_content, loaded_contents, commentary
+        )
+
+        agent_input = BaseAgentInputSchema(chat_message=user_input)
+        memory = self.memory.copy()
+        memory.add_message("user", agent_input)
+        messages = [
+            {"role": "system", "content": self._system_blocks(static, volatile)}
+        ]
+        messages += memory.get_history()
+        # create_partial yields cumulative snapshots of the partial model,
+        # not deltas, and early snapshots may not have chat_message set yet;
+        # only the latest complete snapshot is kept.
+        snapshot = ""
+        async for partial in self.async_client.chat.completions.create_partial(
+            model=self.model,
+            max_tokens=self._max_tokens,
+            messages=messages,
+            response_model=self.output_schema,
+        ):
+            if partial.chat_message is None:
+                continue
+            delta = partial.chat_message[len(snapshot):]
+            snapshot = partial.chat_message
+            if on_chunk is not None and delta:
+                on_chunk(delta)
+        result_text = snapshot.strip()
+
+        async with self._instance_async_lock:
+            self._append_to_instance(f"\n---\n\n## {protocol.name}\n\n{result_text}\n")
+        return result_text
+
+    def run_chain(
+        self,
+        user_input: str,
+        protocols: list[Protocol],
+        reservoir_dir: Path,
+        commentary: str | None = None,
+    ) -> dict[str, str]:
+        """Run every protocol, honoring ``depends_on`` and overlapping the rest.
+
+        Like :meth:`run_chain_async`, protocols are grouped into dependency
+        waves; each wave is submitted to a thread pool in one pass and
+        collected in a second, so independent blocking LLM calls overlap
+        instead of serializing.
+        """
+        self._prewarm_reservoirs(protocols, reservoir_dir)
+        self._reset_instance(
+            "".join((INSTANCE_HEADER, "\n", USER_INPUT_MARKER, "\n", user_input, "\n"))
+        )
+        reservoir_cache: dict[str, str] = {}
+        remaining = {p.name: p for p in protocols if p.include_in_chain}
+        results: dict[str, str] = {}
+        while remaining:
+            wave = [
+                p
+                for p in remaining.values()
+                if all(dep not in remaining for dep in p.depends_on)
+            ]
+            if not wave:
+                raise ValueError(
+                    "Unsatisfiable protocol dependencies among: "
+                    + ", ".join(sorted(remaining))
+                )
+            for protocol in wave:
+                logger.info("Running protocol: %s", protocol.name)
+            with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+                futures = {
+                    p.name: executor.submit(
+                        self.run_protocol,
+                        user_input,
+                        p,
+                        reservoir_dir,
+                        commentary,
+                        reservoir_cache,
+                    )
+                    for p in wave
+                }
+                for name, future in futures.items():
+                    results[name] = future.result()
+                    del remaining[name]
+        self._flush_instance()
+        return results
+
+    async def run_chain_async(
+        self,
+        user_input: str,
+        protocols: list[Protocol],
+        reservoir_dir: Path,
+        commentary: str | None = None,
+        max_concurrency: int = 4,
+    ) -> dict[str, str]:
+        """Async variant of :meth:`run_chain`.
+
+        Protocols are scheduled in dependency waves: every protocol whose
+        ``depends_on`` entries have all finished runs concurrently with the
+        rest of its wave, so independent LLM calls overlap.  At most
+        ``max_concurrency`` protocols are in flight at once, keeping wide
+        waves inside Anthropic rate limits.
+        """
+        self._prewarm_reservoirs(protocols, reservoir_dir)
+        self._reset_instance(
+            "".join((INSTANCE_HEADER, "\n", USER_INPUT_MARKER, "\n", user_input, "\n"))
+        )
+        semaphore = asyncio.Semaphore(max_concurrency)
+        reservoir_cache: dict[str, str] = {}
+
+        async def run_bounded(protocol: Protocol) -> str:
+            async with semaphore:
+                return await self.run_protocol_async(
+                    user_input, protocol, reservoir_dir, commentary, reservoir_cache
+                )
+
+        remaining = {p.name: p for p in protocols if p.include_in_chain}
+        results: dict[str, str] = {}
+        while remaining:
+            wave = [
+                p
+                for p in remaining.values()
+                if all(dep not in remaining for dep in p.depends_on)
+            ]
+            if not wave:
+                raise ValueError(
+                    "Unsatisfiable protocol dependencies among: "
+                    + ", ".join(sorted(remaining))
+                )
+            for protocol in wave:
+                logger.info("Running protocol: %s", protocol.name)
+            outputs = await asyncio.gather(*(run_bounded(p) for p in wave))
+            for protocol, output in zip(wave, outputs):
+                results[protocol.name] = output
+                del remaining[protocol.name]
+        self._flush_instance()
+        return results
+
+    def run_chain_batch(
+        self,
+        inputs: list[str],
+        protocols: list[Protocol],
+        reservoir_dir: Path,
+        anthropic_client,
+        commentary: str | None = None,
+        poll_interval: float = 5.0,
+    ) -> list[dict[str, str]]:
+        """Run many user inputs through the chain via the Message Batches API.
+
+        For each dependency wave, every ``(input, protocol)`` pair is
+        submitted in one ``messages.batches.create`` call (custom_id
+        ``"{input_index}_{wave_index}"`` — the API only allows
+        ``[a-zA-Z0-9_-]``, so protocol names stay out of the id and are
+        recovered through the wave list), polled until the batch ends, and
+        collected before the next wave starts.  Batched requests are
+        billed at a discount and throughput is far higher than per-request
+        calls, at the cost of latency, so this path is for offline
+        re-processing rather than interactive sessions.
+
+        Each input keeps its own working memory, persisted as
+        ``instance_{i}.md`` beside the chain's instance file.  ``anthropic_client``
+        is a raw ``anthropic.Anthropic`` instance: batch results are plain
+        messages, not instructor-validated schemas.
+        """
+        self._prewarm_reservoirs(protocols, reservoir_dir)
+        reservoir_cache: dict[str, str] = {}
+        instances = [
+            io.StringIO(
+                "".join(
+                    (INSTANCE_HEADER, "\n", USER_INPUT_MARKER, "\n", user_input, "\n")
+                )
+            )
+            for user_input in inputs
+        ]
+        for buf in instances:
+            buf.seek(0, io.SEEK_END)
+        remaining = {p.name: p for p in protocols if p.include_in_chain}
+        results: list[dict[str, str]] = [{} for _ in inputs]
+        while remaining:
+            wave = [
+                p
+                for p in remaining.values()
+                if all(dep not in remaining for dep in p.depends_on)
+            ]
+            if not wave:
+                raise ValueError(
+                    "Unsatisfiable protocol dependencies among: "
+                    + ", ".join(sorted(remaining))
+                )
+            requests = []
+            for j, protocol in enumerate(wave):
+                logger.info("Batching protocol: %s", protocol.name)
+                loaded_contents = self._load_access_contents(
+                    protocol, reservoir_dir, reservoir_cache
+                )
+                for i, user_input in enumerate(inputs):
+                    static, volatile = self._build_prompt_parts(
+                        protocol,
+                        user_input,
+                        instances[i].getvalue(),
+                        loaded_contents,
+                        commentary,
+                    )
+                    requests.append(
+                        {
+                            "custom_id": f"{i}_{j}",
+                            "params": {
+                                "model": self.model,
+                                "max_tokens": self._max_tokens,
+                                "system": self._system_blocks(static, volatile),
+                                "messages": [
+                                    {"role": "user", "content": user_input}
+                                ],
+                            },
+                        }
+                    )
+            batch = anthropic_client.messages.batches.create(requests=requests)
+            while batch.processing_status != "ended":
+                time.sleep(poll_interval)
+                batch = anthropic_client.messages.batches.retrieve(batch.id)
+            for entry in anthropic_client.messages.batches.results(batch.id):
+                if entry.result.type != "succeeded":
+                    logger.warning(
+                        "Batch request %s ended as %s", entry.custom_id, entry.result.type
+                    )
+                    continue
+                index_str, _, wave_index = entry.custom_id.partition("_")
+                name = wave[int(wave_index)].name
+                text = "".join(
+                    block.text
+                    for block in entry.result.message.content
+                    if block.type == "text"
+                ).strip()
+                i = int(index_str)
+                results[i][name] = text
+                instances[i].write(f"\n---\n\n## {name}\n\n{text}\n")
+            for protocol in wave:
+                del remaining[protocol.name]
+        for i, buf in enumerate(instances):
+            write_text_atomic(
+                self.instance_file.with_name(f"instance_{i}.md"), buf.getvalue()
+            )
+        return results
+
+
+def default_protocols(prompt_dir: str | Path) -> list[Protocol]:
+    """Build the standard Extract -> Atomize -> Reflect -> Integrate chain."""
+    prompt_dir = Path(prompt_dir)
+    extract_protocol = Protocol(
+        "Extract",
+        prompt_dir / "extract.md",
+        {"Intuition Reservoir": "Intuition_Reservoir.md"},
+    )
+    atomize_protocol = Protocol(
+        "Atomize",
+        prompt_dir / "atomize.md",
+        {
+            "Intuition Reservoir": "Intuition_Reservoir.md",
+            "Abstraction Theory": "Abstraction_Theory.md",
+        },
+    )
+    reflect_protocol = Protocol(
+        "Reflect",
+        prompt_dir / "reflect.md",
+        {
+            "Intuition Reservoir": "Intuition_Reservoir.md",
+            "Working Memory": "instance.md",
+        },
+        depends_on=["Extract", "Atomize"],
+    )
+    integrate_protocol = Protocol(
+        "Integrate",
+        prompt_dir / "integrate.md",
+        {
+            "Intuition Reservoir": "Intuition_Reservoir.md",
+            "Abstraction Theory": "Abstraction_Theory.md",
+            "Working Memory": "instance.md",
+        },
+        depends_on=["Reflect"],
+    )
+    return [extract_protocol, atomize_protocol, reflect_protocol, integrate_protocol]
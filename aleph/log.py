@@ -0,0 +1,25 @@
+"""Logging setup for aleph."""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+
+
+def setup_queue_logging(level: int = logging.INFO) -> None:
+    """Route log records through a background QueueListener thread.
+
+    Chain status messages are emitted from the protocol hot path (and, in
+    the async path, from concurrently running protocols); queueing keeps
+    record formatting and stream I/O off the caller's thread so prints
+    can't serialize otherwise-parallel work.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
@@ -0,0 +1,32 @@
+"""Abstraction-node storage backing the reservoirs."""
+
+import itertools
+
+
+class AbstractionNode:
+    """A single abstraction with links to the nodes it generalizes."""
+
+    _counter = itertools.count()
+
+    def __init__(self, content: str, parents: list[int] | None = None) -> None:
+        # Ids are only ever used as internal dict keys, so a monotonic int
+        # is enough: it hashes cheaper than a 36-char uuid string and skips
+        # the per-node urandom read that uuid4 would cost.
+        self.id = next(AbstractionNode._counter)
+        self.content = content
+        self.parents = list(parents or [])
+
+
+class MemoryManager:
+    """Holds every AbstractionNode for a session, keyed by node id."""
+
+    def __init__(self) -> None:
+        self.nodes: dict[int, AbstractionNode] = {}
+
+    def add(self, content: str, parents: list[int] | None = None) -> AbstractionNode:
+        node = AbstractionNode(content, parents)
+        self.nodes[node.id] = node
+        return node
+
+    def get(self, node_id: int) -> AbstractionNode | None:
+        return self.nodes.get(node_id)
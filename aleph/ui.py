@@ -0,0 +1,78 @@
+"""Interactive editor helpers for aleph sessions."""
+
+import mmap
+import os
+from pathlib import Path
+
+import click
+
+from aleph.agent import USER_INPUT_MARKER
+
+_USER_INPUT_MARKER = USER_INPUT_MARKER.encode("utf-8")
+# The user-input block is operator-typed text; cap how much we decode so a
+# marker near the front of a huge instance file can't pull the whole tail in.
+_MAX_USER_INPUT_BYTES = 1 << 20
+
+_EDIT_BANNER = "# Edit your user input below. Lines starting with '#' are ignored.\n"
+_COMMENTARY_BANNER = (
+    "# Add commentary for this chain run below. Lines starting with '#' are ignored.\n"
+)
+
+
+def obtain_user_input(instance_path: str | Path) -> str:
+    """Let the operator edit the ``[User Input]:`` block of the instance file.
+
+    Opens the current user input (if any) in the operator's editor, strips
+    comment lines, writes the result back into the instance file, and
+    returns it.  The instance file is scanned byte-wise through mmap, so
+    only the user-input slice is ever decoded no matter how large the
+    working memory has grown.
+    """
+    instance_path = Path(instance_path)
+    head = b""
+    current = ""
+    if instance_path.exists() and instance_path.stat().st_size:
+        with open(instance_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = mm.find(_USER_INPUT_MARKER)
+                if offset >= 0:
+                    head = mm[:offset]
+                    start = offset + len(_USER_INPUT_MARKER)
+                    block = mm[start : start + _MAX_USER_INPUT_BYTES].decode(
+                        "utf-8", errors="replace"
+                    )
+                    end = block.find("\n---")
+                    if end >= 0:
+                        block = block[:end]
+                    current = block.strip()
+                else:
+                    head = mm[:] + b"\n"
+
+    edited_text = click.edit(_EDIT_BANNER + current)
+    if edited_text is None:
+        return current
+    user_input = "\n".join(
+        line for line in edited_text.splitlines() if not line.lstrip().startswith("#")
+    ).strip()
+
+    # Rewrite via a temp file and rename so an interrupted save can't
+    # leave a half-written working memory behind.
+    tmp_path = instance_path.with_name(instance_path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(head)
+        f.write(_USER_INPUT_MARKER)
+        f.write(b"\n")
+        f.write(user_input.encode("utf-8"))
+        f.write(b"\n---\n")
+    os.replace(tmp_path, instance_path)
+    return user_input
+
+
+def obtain_commentary() -> str:
+    """Collect optional operator commentary for a chain run through the editor."""
+    edited_text = click.edit(_COMMENTARY_BANNER)
+    if edited_text is None:
+        return ""
+    return "\n".join(
+        line for line in edited_text.splitlines() if not line.lstrip().startswith("#")
+    ).strip()
@@ -0,0 +1,170 @@
+"""Filesystem helpers for aleph."""
+
+import functools
+import mmap
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import liburing
+except ImportError:
+    liburing = None
+
+_HAS_URING = liburing is not None and sys.platform == "linux"
+
+# One-shot staging area letting batch readers hand already-decoded text to
+# _load_markdown_cached without a second disk read.
+_PENDING_SEED: dict[tuple[str, int, int], str] = {}
+
+# Above this size, map the file instead of copying it through the buffered
+# reader; below it, the mmap setup costs more than the copy it saves.
+_MMAP_THRESHOLD = 64 * 1024
+
+
+def read_text_file(path: str, size: int) -> str:
+    """Read a UTF-8 text file of known size, via mmap once it exceeds the
+    threshold."""
+    if size >= _MMAP_THRESHOLD:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                return mm[:].decode("utf-8")
+        finally:
+            os.close(fd)
+    return Path(path).read_text(encoding="utf-8")
+
+
+@functools.lru_cache(maxsize=64)
+def _load_markdown_cached(path: str, mtime_ns: int, size: int) -> str:
+    # mtime_ns and size are part of the cache key purely to invalidate
+    # stale entries when the file changes on disk.
+    seeded = _PENDING_SEED.pop((path, mtime_ns, size), None)
+    if seeded is not None:
+        return seeded
+    return read_text_file(path, size)
+
+
+def load_markdown(path: str) -> str:
+    """Load a markdown file, serving unchanged files from an in-memory cache.
+
+    Cache entries are keyed on ``(abspath, st_mtime_ns, st_size)``, so an
+    edited file is re-read automatically on the next call and the same file
+    reached through different relative paths shares one entry.
+    """
+    path = os.path.abspath(path)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        # Only a genuinely absent file gets the friendly message; other
+        # OSErrors (permissions, ENOTDIR, ...) are real errors and propagate.
+        raise FileNotFoundError(f"Markdown file not found: {path}") from None
+    return _load_markdown_cached(path, st.st_mtime_ns, st.st_size)
+
+
+def write_text_atomic(path: str | Path, content: str) -> None:
+    """Write a text file via a same-directory temp file and ``os.replace``.
+
+    Readers only ever see the old or the new content — a crash mid-write
+    leaves the original file intact — and the rename commits the whole
+    file in one step instead of truncate-then-write.
+    """
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(content, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def clear_markdown_cache() -> None:
+    """Drop all cached markdown contents (primarily for tests)."""
+    _load_markdown_cached.cache_clear()
+    _PENDING_SEED.clear()
+
+
+def _load_or_none(path: str) -> str | None:
+    # Missing files are common (optional reservoirs); check first so the
+    # hot path doesn't raise, keeping FileNotFoundError only for the race
+    # where the file vanishes between check and read.
+    if not os.path.isfile(path):
+        return None
+    try:
+        return load_markdown(path)
+    except FileNotFoundError:
+        return None
+
+
+def _read_batch_uring(entries: list[tuple[str, int]]) -> list[bytes | None]:
+    """Read (path, size) entries in one io_uring submission; None on failure."""
+    ring = liburing.io_uring()
+    liburing.io_uring_queue_init(len(entries), ring, 0)
+    fds: list[int] = []
+    bufs: list[bytearray] = []
+    try:
+        for path, size in entries:
+            fd = os.open(path, os.O_RDONLY)
+            fds.append(fd)
+            buf = bytearray(size)
+            bufs.append(buf)
+            sqe = liburing.io_uring_get_sqe(ring)
+            liburing.io_uring_prep_read(sqe, fd, buf, size, 0)
+            sqe.user_data = len(bufs) - 1
+        liburing.io_uring_submit(ring)
+        out: list[bytes | None] = [None] * len(entries)
+        cqe = liburing.io_uring_cqe()
+        for _ in range(len(entries)):
+            liburing.io_uring_wait_cqe(ring, cqe)
+            idx = cqe.user_data
+            # A short read would seed truncated text into the cache under
+            # the file's full size; anything but a complete buffer is
+            # treated as a failure so the caller re-reads conventionally.
+            if cqe.res == len(bufs[idx]):
+                out[idx] = bytes(bufs[idx])
+            liburing.io_uring_cqe_seen(ring, cqe)
+        return out
+    finally:
+        for fd in fds:
+            os.close(fd)
+        liburing.io_uring_queue_exit(ring)
+
+
+def load_markdown_batch(paths: list[str]) -> list[str | None]:
+    """Read several markdown files at once, returning None for unreadable ones.
+
+    On Linux with the optional ``liburing`` package installed, the reads are
+    batched into a single io_uring submission, amortizing syscall overhead
+    across the batch; decoded contents are seeded into the markdown cache.
+    Elsewhere (or on any io_uring failure) files load through
+    :func:`load_markdown` on a thread pool.
+    """
+    paths = [os.path.abspath(p) for p in paths]
+    if _HAS_URING and len(paths) > 1:
+        stats: list[tuple[int, str, os.stat_result]] = []
+        for i, path in enumerate(paths):
+            try:
+                stats.append((i, path, os.stat(path)))
+            except OSError:
+                pass
+        if len(stats) > 1:
+            try:
+                raw = _read_batch_uring([(p, st.st_size) for _, p, st in stats])
+            except Exception:
+                raw = None
+            if raw is not None:
+                results: list[str | None] = [None] * len(paths)
+                try:
+                    for (i, path, st), data in zip(stats, raw):
+                        if data is None:
+                            continue
+                        key = (path, st.st_mtime_ns, st.st_size)
+                        _PENDING_SEED[key] = data.decode("utf-8")
+                        results[i] = _load_or_none(path)
+                finally:
+                    _PENDING_SEED.clear()
+                return results
+    if len(paths) > 1:
+        with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            return list(executor.map(_load_or_none, paths))
+    return [_load_or_none(p) for p in paths]
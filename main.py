@@ -1,5 +1,82 @@
+import os
+from pathlib import Path
+
+import anthropic
+import httpx
+import instructor
+from atomic_agents.agents.base_agent import BaseAgentConfig
+from atomic_agents.lib.components.agent_memory import AgentMemory
+
+from aleph.agent import AgentChain, default_protocols
+from aleph.log import setup_queue_logging
+from aleph.ui import obtain_commentary, obtain_user_input
+
+RESERVOIR_DIR = Path("reservoirs")
+PROTOCOL_PROMPT_DIR = Path("spec/protocols")
+MODEL = "claude-3-5-sonnet-20241022"
+
+_http_client: httpx.Client | None = None
+
+
+def get_http_client() -> httpx.Client:
+    """Return the process-wide pooled HTTP client, creating it on first use.
+
+    Every AgentChain talks to the same API host, so sharing one client
+    lets concurrent protocols reuse keep-alive TCP/TLS sessions (and
+    multiplex over HTTP/2) instead of paying connection setup per chain.
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        )
+    return _http_client
+
+
+_async_http_client: httpx.AsyncClient | None = None
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Async counterpart of :func:`get_http_client`.
+
+    Pass the result to ``anthropic.AsyncAnthropic(http_client=...)`` when
+    building the ``async_client`` for AgentChain's streaming paths.
+    """
+    global _async_http_client
+    if _async_http_client is None:
+        _async_http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        )
+    return _async_http_client
+
+
 def main():
-    print("Hello from aleph!")
+    setup_queue_logging()
+    client = instructor.from_anthropic(
+        anthropic.Anthropic(
+            api_key=os.environ["ANTHROPIC_API_KEY"], http_client=get_http_client()
+        )
+    )
+    protocols = default_protocols(PROTOCOL_PROMPT_DIR)
+    # Run the editor steps before constructing the chain: the editor save
+    # replaces instance.md atomically, and the chain holds an append fd on
+    # the file from construction onwards.
+    user_input = obtain_user_input(RESERVOIR_DIR / "instance.md")
+    commentary = obtain_commentary()
+    chain = AgentChain(
+        BaseAgentConfig(
+            client=client,
+            model=MODEL,
+            memory=AgentMemory(),
+            max_tokens=8096,
+        ),
+        instance_file=RESERVOIR_DIR / "instance.md",
+    )
+    results = chain.run_chain(user_input, protocols, RESERVOIR_DIR, commentary)
+    for name, text in results.items():
+        print(f"\n## {name}\n\n{text}")
 
 
 if __name__ == "__main__":